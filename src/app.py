@@ -1,15 +1,22 @@
 import logging
 import os
+import threading
 import time
-from flask import Flask, request, jsonify, redirect, session, url_for
+import orjson
+import redis
+from flask import Flask, Response, request, redirect, session, url_for
+from flask_compress import Compress
 from flask_cors import CORS
+from flask_session import Session
+from cachetools import TTLCache
 from dotenv import load_dotenv
 from functools import wraps
 from typing import List, Dict
+from xml.sax.saxutils import escape
 
 from config import Config
-from strava_client import get_strava_client, StravaAPIError
-from poi_service import get_pois_for_route
+from strava_client import get_strava_client, token_fingerprint, StravaAPIError
+from poi_service import get_pois_for_route, RouteTooLongError
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -25,6 +32,19 @@ except ValueError as e:
 app = Flask(__name__)
 app.secret_key = Config.FLASK_SECRET_KEY
 
+# Keep sessions server-side in Redis when configured, so the cookie only
+# carries a session id rather than the signed Strava token
+if Config.REDIS_URL:
+    app.config["SESSION_TYPE"] = "redis"
+    app.config["SESSION_REDIS"] = redis.from_url(Config.REDIS_URL)
+    Session(app)
+
+# Compress JSON responses; coordinate streams and GPX shrink several-fold
+app.config["COMPRESS_ALGORITHM"] = ["br", "zstd", "gzip"]
+app.config["COMPRESS_MIMETYPES"] = ["application/json"]
+app.config["COMPRESS_MIN_SIZE"] = 1024
+Compress(app)
+
 # Configure CORS with credentials support
 CORS(app, 
      origins=['http://localhost:3000'],  # Specific origin, not *
@@ -34,25 +54,60 @@ CORS(app,
 
 strava_api = get_strava_client()
 
+# Generated GPX documents, keyed by activity and token so they are only
+# served back to the user who fetched them. Bounded by total characters
+# (about 32 MB) since a long ride's GPX runs to several megabytes.
+GPX_CACHE_MAX_CHARS = 32 * 1024 * 1024
+gpx_cache = TTLCache(maxsize=GPX_CACHE_MAX_CHARS, ttl=3600, getsizeof=len)
+gpx_cache_lock = threading.Lock()
+
+def orjsonify(obj) -> Response:
+    """Like jsonify, but serialized with orjson for faster encoding of large payloads."""
+    return app.response_class(
+        orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY),
+        mimetype="application/json"
+    )
+
+# Refresh tokens this many seconds before they expire so they can't lapse mid-request
+REFRESH_SKEW = 60
+
+# Striped refresh locks plus a short-lived record of each refresh's result,
+# so concurrent requests near expiry share a single refresh round-trip
+REFRESH_LOCK_STRIPES = 64
+refresh_locks = tuple(threading.Lock() for _ in range(REFRESH_LOCK_STRIPES))
+refreshed_tokens = TTLCache(maxsize=1024, ttl=REFRESH_SKEW)
+refreshed_tokens_lock = threading.Lock()
+
+def refresh_session_token(refresh_token: str) -> Dict:
+    """Refreshes a Strava token, reusing a refresh another request has just made."""
+    key = token_fingerprint(refresh_token)
+    with refresh_locks[int(key, 16) % REFRESH_LOCK_STRIPES]:
+        with refreshed_tokens_lock:
+            token_info = refreshed_tokens.get(key)
+        if token_info is None or token_info['expires_at'] < time.time() + REFRESH_SKEW:
+            token_info = strava_api.refresh_access_token(refresh_token)
+            with refreshed_tokens_lock:
+                refreshed_tokens[key] = token_info
+            logger.info("Token refreshed for user")
+        return token_info
+
 def auth_required(f):
     """Decorator to protect endpoints that require authentication."""
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'strava_token' not in session:
-            return jsonify({"error": "Authentication required"}), 401
+            return orjsonify({"error": "Authentication required"}), 401
 
         # Check if the token is expired and refresh if necessary
         token_info = session['strava_token']
-        if token_info['expires_at'] < time.time():
+        if token_info['expires_at'] < time.time() + REFRESH_SKEW:
             try:
-                new_token_info = strava_api.refresh_access_token(token_info['refresh_token'])
-                session['strava_token'] = new_token_info
+                session['strava_token'] = refresh_session_token(token_info['refresh_token'])
                 session.modified = True
-                logger.info("Token refreshed for user")
             except StravaAPIError as e:
                 logger.error(f"Token refresh failed: {e}")
                 session.clear()
-                return jsonify({"error": "Authentication expired, please re-authenticate"}), 401
+                return orjsonify({"error": "Authentication expired, please re-authenticate"}), 401
 
         return f(*args, **kwargs)
     return decorated_function
@@ -60,14 +115,14 @@ def auth_required(f):
 
 def create_gpx_string(activity_name: str, coords: list) -> str:
     """Creates a GPX XML string from a list of lat/lng coordinates."""
-    gpx_points = ""
-    for lat, lng in coords:
-        gpx_points += f"  <trkpt lat=\"{lat}\" lon=\"{lng}\"></trkpt>\n"
+    # Fixed 7 decimal places (~1 cm) bounds the output size and keeps it deterministic
+    trkpt = '  <trkpt lat="%.7f" lon="%.7f"></trkpt>'
+    gpx_points = "\n".join(trkpt % (lat, lng) for lat, lng in coords)
 
     return f"""<?xml version="1.0" encoding="UTF-8"?>
 <gpx version="1.1" creator="Strava Route Discovery App" xmlns="http://www.topografix.com/GPX/1/1">
   <trk>
-    <name>{activity_name}</name>
+    <name>{escape(activity_name)}</name>
     <trkseg>
 {gpx_points}
     </trkseg>
@@ -83,13 +138,13 @@ def get_activity_stream_data(activity_id):
     try:
         latlng_stream = strava_api.get_activity_stream(activity_id, access_token)
         if not latlng_stream:
-            return jsonify({"error": "No GPS data found for this activity"}), 404
+            return orjsonify({"error": "No GPS data found for this activity"}), 404
         
         # The frontend expects [latitude, longitude], but the stream is [lat, lng]. It's already correct.
-        return jsonify({"stream": latlng_stream})
+        return orjsonify({"stream": latlng_stream})
     except StravaAPIError as e:
         logger.error(f"Failed to fetch stream for activity {activity_id}: {e}")
-        return jsonify({"error": "Failed to fetch activity data"}), 500
+        return orjsonify({"error": "Failed to fetch activity data"}), 500
     
 
 @app.route("/auth/strava")
@@ -123,15 +178,15 @@ def strava_callback():
 def auth_status():
     """Checks if the user is currently authenticated."""
     if 'strava_token' in session and session['strava_token']['expires_at'] > time.time():
-        return jsonify({"authenticated": True})
-    return jsonify({"authenticated": False})
+        return orjsonify({"authenticated": True})
+    return orjsonify({"authenticated": False})
 
 
 @app.route("/auth/logout", methods=['POST'])
 def logout():
     """Logs the user out by clearing the session."""
     session.clear()
-    return jsonify({"message": "Successfully logged out"}), 200
+    return orjsonify({"message": "Successfully logged out"}), 200
 
 @app.route("/api/activities")
 @auth_required
@@ -149,13 +204,13 @@ def get_activities():
                 "type": act["type"],
                 "start_date": act["start_date_local"],
             }
-            for act in activities if act.get("map", {}).get("summary_polyline")
+            for act in activities if (act.get("map") or {}).get("summary_polyline")
         ]
         logger.info(f"Fetched {len(filtered_activities)} activities for user")
-        return jsonify(filtered_activities)
+        return orjsonify(filtered_activities)
     except StravaAPIError as e:
         logger.error(f"Failed to fetch activities: {e}")
-        return jsonify({"error": "Failed to fetch activities"}), 500
+        return orjsonify({"error": "Failed to fetch activities"}), 500
 
 
 @app.route("/api/activities/<int:activity_id>/gpx")
@@ -163,16 +218,25 @@ def get_activities():
 def get_activity_gpx(activity_id):
     """Fetches GPX data for a specific activity."""
     access_token = session['strava_token']['access_token']
+    cache_key = (activity_id, token_fingerprint(access_token))
+    with gpx_cache_lock:
+        gpx_data = gpx_cache.get(cache_key)
+    if gpx_data is not None:
+        return orjsonify({"gpx": gpx_data})
+
     try:
         latlng_stream = strava_api.get_activity_stream(activity_id, access_token)
         if not latlng_stream:
-            return jsonify({"error": "No GPS data found for this activity"}), 404
+            return orjsonify({"error": "No GPS data found for this activity"}), 404
 
         gpx_data = create_gpx_string(f"Activity {activity_id}", latlng_stream)
-        return jsonify({"gpx": gpx_data})
+        if len(gpx_data) <= GPX_CACHE_MAX_CHARS:
+            with gpx_cache_lock:
+                gpx_cache[cache_key] = gpx_data
+        return orjsonify({"gpx": gpx_data})
     except StravaAPIError as e:
         logger.error(f"Failed to fetch GPX for activity {activity_id}: {e}")
-        return jsonify({"error": "Failed to fetch activity data"}), 500
+        return orjsonify({"error": "Failed to fetch activity data"}), 500
 
 
 @app.route("/api/pois", methods=['POST'])
@@ -180,24 +244,27 @@ def get_nearby_pois():
     """Finds points of interest near a given route."""
     data = request.get_json()
     if not data or 'route' not in data:
-        return jsonify({"error": "Route data is required"}), 400
+        return orjsonify({"error": "Route data is required"}), 400
     
     route = data['route']
     if not isinstance(route, list) or len(route) < 2:
-        return jsonify({"error": "Route must be a list with at least 2 coordinates"}), 400
+        return orjsonify({"error": "Route must be a list with at least 2 coordinates"}), 400
 
     # Convert [lat, lng] to [lng, lat] for Google Maps API
     try:
         route_coords = [[coord[1], coord[0]] for coord in route]
         pois = get_pois_for_route(route_coords)
         logger.info(f"Found {len(pois)} POIs for route")
-        return jsonify(pois)
+        return orjsonify(pois)
+    except RouteTooLongError as e:
+        logger.warning(f"Rejected route: {e}")
+        return orjsonify({"error": str(e)}), 400
     except (IndexError, TypeError) as e:
         logger.error(f"Invalid route format: {e}")
-        return jsonify({"error": "Invalid route coordinate format"}), 400
+        return orjsonify({"error": "Invalid route coordinate format"}), 400
     except Exception as e:
         logger.error(f"Error fetching POIs: {e}")
-        return jsonify({"error": "Failed to retrieve points of interest"}), 500
+        return orjsonify({"error": "Failed to retrieve points of interest"}), 500
 
 if __name__ == "__main__":
     app.run(port=5000, debug=Config.FLASK_DEBUG)
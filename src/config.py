@@ -12,6 +12,9 @@ class Config:
     FLASK_SECRET_KEY: str = os.getenv("FLASK_SECRET_KEY", "dev-secret-key")
     FLASK_DEBUG: bool = os.getenv("FLASK_ENV") == "development"
     
+    # Optional Redis server for server-side sessions
+    REDIS_URL: Optional[str] = os.getenv("REDIS_URL")
+    
     # Strava API settings
     STRAVA_CLIENT_ID: Optional[str] = os.getenv("STRAVA_CLIENT_ID")
     STRAVA_CLIENT_SECRET: Optional[str] = os.getenv("STRAVA_CLIENT_SECRET")
@@ -22,6 +25,8 @@ class Config:
     # POI search settings
     POI_SEARCH_RADIUS: int = int(os.getenv("POI_SEARCH_RADIUS", "100"))
     POI_ROUTE_SAMPLING_DISTANCE: int = int(os.getenv("POI_ROUTE_SAMPLING_DISTANCE", "500"))
+    POI_MAX_WORKERS: int = int(os.getenv("POI_MAX_WORKERS", "8"))
+    POI_MAX_CELLS_PER_ROUTE: int = int(os.getenv("POI_MAX_CELLS_PER_ROUTE", "500"))
     
     @classmethod
     def validate(cls) -> None:
@@ -1,14 +1,26 @@
 # Gunicorn config file
+import os
 
 # The address to bind to.
 bind = "0.0.0.0:8000"
 
 # The number of worker processes.
-# A common recommendation is 2-4 x $(NUM_CORES)
-workers = 4
+# Each worker holds its own Strava, GPX and Places caches, so extra workers
+# multiply cache memory and miss each other's entries; concurrency comes
+# from threads instead. Set explicitly rather than from cpu_count(), which
+# reports the host's CPUs inside a container.
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
 
 # The type of worker class.
-worker_class = "sync"
+# Every endpoint waits on Strava or Google, so threaded workers let each
+# process keep serving other requests while one is blocked on the network.
+worker_class = "gthread"
+
+# The number of threads per worker when using gthread.
+threads = 16
+
+# The maximum number of simultaneous client connections per worker.
+worker_connections = 1000
 
 # The location of the log files.
 accesslog = "-"  # Log to stdout
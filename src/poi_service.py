@@ -1,27 +1,176 @@
 import logging
-from typing import List, Dict, Tuple
-import googlemaps
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Tuple
+import httpx
+import numpy as np
+from cachetools import TTLCache
 from config import Config
 
 logger = logging.getLogger(__name__)
 
-# Initialize Google Maps client
-gmaps = googlemaps.Client(key=Config.GOOGLE_MAPS_API_KEY) if Config.GOOGLE_MAPS_API_KEY else None
+class PlacesAPIError(Exception):
+    """Custom exception for Google Places API errors"""
+    pass
+
+class RouteTooLongError(ValueError):
+    """Raised when a route would need more Places searches than a request is allowed"""
+    pass
+
+PLACES_NEARBY_URL = "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
+PLACES_OK_STATUSES = frozenset(("OK", "ZERO_RESULTS"))
+PLACES_MAX_ATTEMPTS = 3
+
+# Initialize a shared HTTP/2 client so concurrent Places searches multiplex
+# over one connection instead of each paying for a TLS handshake
+places_client = httpx.Client(
+    http2=True,
+    timeout=10,
+    limits=httpx.Limits(max_connections=20)
+) if Config.GOOGLE_MAPS_API_KEY else None
+
+# httpx logs every request URL at INFO, and Places URLs carry the API key
+logging.getLogger("httpx").setLevel(logging.WARNING)
 
 # Types of POIs to search for
-POI_TYPES = [
+POI_TYPES = (
     "cafe", "restaurant", "bar", "tourist_attraction", 
     "museum", "park", "art_gallery", "viewpoint"
-]
+)
+POI_TYPES_SET = frozenset(POI_TYPES)
+POI_TYPES_PARAM = "|".join(POI_TYPES)  # Multiple types in one request
+
+# (place_id, name, type, lat, lng, rating, price_level)
+PlaceResult = Tuple[str, str, str, float, float, Optional[float], Optional[int]]
+
+EARTH_RADIUS_M = 6371000
+METRES_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180
+
+# Places results keyed by the grid cell they were searched from, shared
+# across routes so rides over the same roads don't repeat API calls.
+# Only the fields get_pois_for_route reads are kept, as PlaceResult tuples.
+_places_cache = TTLCache(maxsize=10000, ttl=3600)
+_places_cache_lock = threading.Lock()
+
+def _cumulative_metres(lat: np.ndarray, lng: np.ndarray) -> np.ndarray:
+    """Haversine distance in metres from the start of the route to each point"""
+    lat_rad = np.radians(lat)
+    dlat = np.diff(lat_rad)
+    dlng = np.diff(np.radians(lng))
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat_rad[:-1]) * np.cos(lat_rad[1:]) * np.sin(dlng / 2) ** 2
+    segment_m = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+    return np.concatenate(([0.0], np.cumsum(segment_m)))
+
+def _sample_route_points(route_coords: List[List[float]], sample_distance: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Interpolate lat/lng arrays every sample_distance metres along the route, including both ends"""
+    lng, lat = np.asarray(route_coords, dtype=np.float64).T
+    cumulative_m = _cumulative_metres(lat, lng)
+    
+    # Checked before interpolating, so an absurd route can't allocate
+    # millions of samples just to be rejected for its cell count
+    max_length = Config.POI_MAX_CELLS_PER_ROUTE * Config.POI_ROUTE_SAMPLING_DISTANCE
+    if not cumulative_m[-1] <= max_length:
+        raise RouteTooLongError(f"Route is longer than {max_length / 1000:g} km")
+    
+    targets = np.append(np.arange(0, cumulative_m[-1], sample_distance), cumulative_m[-1])
+    return np.interp(targets, cumulative_m, lat), np.interp(targets, cumulative_m, lng)
+
+def _grid_cells(lat: np.ndarray, lng: np.ndarray) -> List[Tuple[int, int]]:
+    """
+    Maps points to (row, column) cells of a fixed grid POI_ROUTE_SAMPLING_DISTANCE
+    metres on a side, so the same stretch of road always falls in the same cells.
+    """
+    size = Config.POI_ROUTE_SAMPLING_DISTANCE
+    rows = np.floor(lat * METRES_PER_DEGREE / size)
+    row_lat = (rows + 0.5) * size / METRES_PER_DEGREE
+    cols = np.floor(lng * METRES_PER_DEGREE * np.cos(np.radians(row_lat)) / size)
+    return list(zip(rows.astype(int).tolist(), cols.astype(int).tolist()))
+
+def _cell_centre(cell: Tuple[int, int]) -> Tuple[float, float]:
+    """Returns the lat/lng centre of a grid cell"""
+    row, col = cell
+    size = Config.POI_ROUTE_SAMPLING_DISTANCE
+    lat = (row + 0.5) * size / METRES_PER_DEGREE
+    return lat, (col + 0.5) * size / (METRES_PER_DEGREE * math.cos(math.radians(lat)))
 
-def _sample_route_points(route_coords: List[List[float]], sample_distance: int = 500) -> List[Tuple[float, float]]:
-    """Sample points along route to reduce API calls while maintaining coverage"""
-    if len(route_coords) <= 2:
-        return [(lat, lng) for lng, lat in route_coords]
+def _route_step() -> float:
+    """Spacing in metres of the route samples used to find cells and filter results"""
+    return Config.POI_SEARCH_RADIUS / 2
+
+def _cell_search_radius() -> int:
+    """
+    Radius that covers everything within POI_SEARCH_RADIUS of any route sample
+    in a cell, or of the route between samples, from the cell's centre.
+    """
+    half_diagonal = Config.POI_ROUTE_SAMPLING_DISTANCE / math.sqrt(2)
+    return math.ceil(Config.POI_SEARCH_RADIUS + half_diagonal + _route_step() / 2)
+
+def _near_samples(lats: np.ndarray, lngs: np.ndarray, sample_lat: np.ndarray, sample_lng: np.ndarray, max_m: float) -> np.ndarray:
+    """Mask of the points lying within max_m metres of any of the samples"""
+    dy = (lats[:, None] - sample_lat[None, :]) * METRES_PER_DEGREE
+    dx = (lngs[:, None] - sample_lng[None, :]) * METRES_PER_DEGREE * np.cos(np.radians(sample_lat))[None, :]
+    return (dx ** 2 + dy ** 2).min(axis=1) <= max_m ** 2
+
+def _places_nearby(location: Tuple[float, float], radius: int) -> List[Dict]:
+    """Calls the Places nearby search endpoint, backing off while over the query limit."""
+    params = {
+        "location": f"{location[0]},{location[1]}",
+        "radius": radius,
+        "type": POI_TYPES_PARAM,
+        "key": Config.GOOGLE_MAPS_API_KEY
+    }
+    for attempt in range(PLACES_MAX_ATTEMPTS):
+        response = places_client.get(PLACES_NEARBY_URL, params=params)
+        response.raise_for_status()
+        data = response.json()
+        status = data.get("status")
+        if status in PLACES_OK_STATUSES:
+            return data.get("results", [])
+        if status != "OVER_QUERY_LIMIT" or attempt == PLACES_MAX_ATTEMPTS - 1:
+            break
+        time.sleep(0.5 * 2 ** attempt)
+    raise PlacesAPIError(f"{status}: {data.get('error_message', 'no error message')}")
+
+def _place_result(poi: Dict) -> PlaceResult:
+    """Reduces a raw Places result to the fields a route's POIs are built from"""
+    poi_type = next((t for t in poi.get("types", ()) if t in POI_TYPES_SET), "point_of_interest")
+    location = poi["geometry"]["location"]
+    return (
+        poi["place_id"], poi.get("name", "Unknown"), poi_type,
+        location["lat"], location["lng"], poi.get("rating"), poi.get("price_level")
+    )
+
+def _search_nearby(cell: Tuple[int, int]) -> List[PlaceResult]:
+    """
+    Runs a Places nearby search for a grid cell, returning an empty list on failure.
+    
+    The search is centred on the cell rather than on any one route's points,
+    so a cached response holds for every route crossing it.
+    """
+    with _places_cache_lock:
+        cached = _places_cache.get(cell)
+    if cached is not None:
+        return cached
+    
+    location = _cell_centre(cell)
+    try:
+        results = [_place_result(poi) for poi in _places_nearby(location, _cell_search_radius())]
+    except PlacesAPIError as e:
+        logger.error(f"Google Maps API error at location {location}: {e}")
+        return []
+    except httpx.HTTPStatusError as e:
+        # The request URL carries the API key, so only log the status
+        logger.error(f"Google Maps API error at location {location}: HTTP {e.response.status_code}")
+        return []
+    except Exception as e:
+        logger.error(f"Unexpected error searching POIs at {location}: {e}")
+        return []
     
-    # For now, simple sampling - could be improved with actual distance calculation
-    step = max(1, len(route_coords) // (len(route_coords) * 100 // sample_distance))
-    return [(lat, lng) for lng, lat in route_coords[::step]]
+    with _places_cache_lock:
+        _places_cache[cell] = results
+    return results
 
 def get_pois_for_route(route_coords: List[List[float]]) -> List[Dict]:
     """
@@ -37,50 +186,68 @@ def get_pois_for_route(route_coords: List[List[float]]) -> List[Dict]:
         logger.warning("Empty route coordinates provided")
         return []
     
-    if not gmaps:
+    if not places_client:
         logger.error("Google Maps client not initialized - check API key")
         return []
     
-    # Sample route points to reduce API calls
-    sample_points = _sample_route_points(route_coords, Config.POI_ROUTE_SAMPLING_DISTANCE)
-    logger.info(f"Searching POIs for {len(sample_points)} sample points along route")
+    # Search once per grid cell the route's samples fall in; cell keys are
+    # stable across rides, so routes sharing roads reuse each other's searches.
+    # A corner the route clips for less than a step may hold no sample and be
+    # skipped, but the neighbouring cells' widened radius still covers it.
+    step = _route_step()
+    sample_lat, sample_lng = _sample_route_points(route_coords, step)
+    cell_samples: Dict[Tuple[int, int], List[int]] = {}
+    for i, cell in enumerate(_grid_cells(sample_lat, sample_lng)):
+        cell_samples.setdefault(cell, []).append(i)
+    cells = list(cell_samples)
+    if len(cells) > Config.POI_MAX_CELLS_PER_ROUTE:
+        raise RouteTooLongError(f"Route crosses {len(cells)} search cells, more than {Config.POI_MAX_CELLS_PER_ROUTE}")
+    logger.info(f"Searching POIs for {len(cells)} cells along route")
     
-    found_pois = {}
+    # Collect fields into parallel lists and only build the response dicts
+    # once, rather than a dict per POI while results are still streaming in
+    seen = set()
+    names, types, lats, lngs, ratings, price_levels = [], [], [], [], [], []
     
-    for lat, lng in sample_points:
-        location = (lat, lng)
+    # Places lookups are I/O bound, so fan them out across a thread pool.
+    # Cache hits return immediately; the pool size caps concurrent requests
+    # for the misses, and OVER_QUERY_LIMIT responses are retried with backoff.
+    with ThreadPoolExecutor(max_workers=Config.POI_MAX_WORKERS) as executor:
+        responses = executor.map(_search_nearby, cells)
         
-        try:
-            # Use nearby search with multiple types in one call
-            results = gmaps.places_nearby(
-                location=location,
-                radius=Config.POI_SEARCH_RADIUS,
-                type="|".join(POI_TYPES)  # Multiple types in one request
-            ).get("results", [])
-            
-            for poi in results:
-                place_id = poi["place_id"]
-                if place_id not in found_pois:
-                    poi_types = poi.get("types", [])
-                    poi_type = next((t for t in poi_types if t in POI_TYPES), "point_of_interest")
-                    
-                    found_pois[place_id] = {
-                        "name": poi.get("name", "Unknown"),
-                        "type": poi_type.replace('_', ' ').title(),
-                        "coords": [
-                            poi["geometry"]["location"]["lat"],
-                            poi["geometry"]["location"]["lng"]
-                        ],
-                        "rating": poi.get("rating"),
-                        "price_level": poi.get("price_level")
-                    }
-                    
-        except googlemaps.ApiError as e:
-            logger.error(f"Google Maps API error at location {location}: {e}")
-            continue
-        except Exception as e:
-            logger.error(f"Unexpected error searching POIs at {location}: {e}")
-            continue
+        for cell, results in zip(cells, responses):
+            if not results:
+                continue
+            # Cell searches reach past the route, so keep only results near
+            # this route's own samples in the cell
+            idx = cell_samples[cell]
+            near = _near_samples(
+                np.array([poi[3] for poi in results]),
+                np.array([poi[4] for poi in results]),
+                sample_lat[idx], sample_lng[idx],
+                Config.POI_SEARCH_RADIUS + step / 2
+            )
+            for (place_id, name, poi_type, lat, lng, rating, price_level), is_near in zip(results, near):
+                if not is_near or place_id in seen:
+                    continue
+                seen.add(place_id)
+                
+                names.append(name)
+                types.append(poi_type)
+                lats.append(lat)
+                lngs.append(lng)
+                ratings.append(rating)
+                price_levels.append(price_level)
     
-    logger.info(f"Found {len(found_pois)} unique POIs")
-    return list(found_pois.values())
\ No newline at end of file
+    logger.info(f"Found {len(names)} unique POIs")
+    return [
+        {
+            "name": name,
+            "type": poi_type.replace('_', ' ').title(),
+            "coords": [lat, lng],
+            "rating": rating,
+            "price_level": price_level
+        }
+        for name, poi_type, lat, lng, rating, price_level
+        in zip(names, types, lats, lngs, ratings, price_levels)
+    ]
\ No newline at end of file
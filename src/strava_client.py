@@ -1,12 +1,38 @@
+import hashlib
+import ijson
 import requests
+import threading
 import time
 import logging
+import urllib3
 from typing import List, Dict, Optional
 from urllib.parse import urlencode
+from cachetools import TTLCache, cachedmethod
+from cachetools.keys import hashkey
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from config import Config
 
 logger = logging.getLogger(__name__)
 
+# Points held across all cached streams; at roughly 128 bytes per [lat, lng]
+# pair this keeps the stream cache near 32 MB per worker
+STREAM_CACHE_MAX_POINTS = 250_000
+
+
+def token_fingerprint(access_token: str) -> str:
+    """Returns a short hash of an access token, safe to use as a cache key."""
+    return hashlib.blake2b(access_token.encode(), digest_size=8).hexdigest()
+
+
+def _activities_key(self, access_token: str, page: int = 1, per_page: int = 30):
+    return hashkey(token_fingerprint(access_token), page, per_page)
+
+
+def _stream_key(self, activity_id: int, access_token: str):
+    return hashkey(activity_id, token_fingerprint(access_token))
+
+
 class StravaAPIError(Exception):
     """Custom exception for Strava API errors"""
     pass
@@ -23,6 +49,20 @@ class StravaAPI:
             raise ValueError("client_id and client_secret are required")
         self.client_id = client_id
         self.client_secret = client_secret
+        # Reuse pooled connections to Strava instead of a new TLS handshake per call
+        self._session = requests.Session()
+        self._session.mount("https://", HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=20,
+            max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504])
+        ))
+        # Short-lived caches so repeated views of the same data don't cost
+        # extra round-trips against Strava's rate limit
+        self._cache_lock = threading.Lock()
+        self._activities_cache = TTLCache(maxsize=128, ttl=60)
+        # Streams vary from a few hundred to tens of thousands of points, so
+        # bound that cache by total points held rather than by entry count
+        self._stream_cache = TTLCache(maxsize=STREAM_CACHE_MAX_POINTS, ttl=300, getsizeof=len)
 
     def get_authorization_url(self, redirect_uri: str) -> str:
         """Generates the Strava authorization URL for the user to visit."""
@@ -44,7 +84,7 @@ class StravaAPI:
             "grant_type": "authorization_code"
         }
         try:
-            response = requests.post(self.TOKEN_URL, data=payload, timeout=10)
+            response = self._session.post(self.TOKEN_URL, data=payload, timeout=10)
             response.raise_for_status()
             return response.json()
         except requests.RequestException as e:
@@ -61,7 +101,7 @@ class StravaAPI:
             "grant_type": "refresh_token"
         }
         try:
-            response = requests.post(self.TOKEN_URL, data=payload, timeout=10)
+            response = self._session.post(self.TOKEN_URL, data=payload, timeout=10)
             response.raise_for_status()
             logger.info("Token refreshed successfully")
             return response.json()
@@ -73,13 +113,15 @@ class StravaAPI:
         """Returns the authorization headers for API requests."""
         return {'Authorization': f'Bearer {access_token}'}
 
+    @cachedmethod(lambda self: self._activities_cache, key=_activities_key,
+                  lock=lambda self: self._cache_lock)
     def get_activities(self, access_token: str, page: int = 1, per_page: int = 30) -> List[Dict]:
         """Fetches a list of the authenticated athlete's activities."""
         headers = self.get_api_headers(access_token)
         params = {'page': page, 'per_page': min(per_page, 200)}  # Strava limit is 200
         
         try:
-            response = requests.get(
+            response = self._session.get(
                 f"{self.API_URL}/athlete/activities", 
                 headers=headers, 
                 params=params,
@@ -91,24 +133,32 @@ class StravaAPI:
             logger.error(f"Failed to fetch activities: {e}")
             raise StravaAPIError(f"Failed to fetch activities: {e}")
 
+    @cachedmethod(lambda self: self._stream_cache, key=_stream_key,
+                  lock=lambda self: self._cache_lock)
     def get_activity_stream(self, activity_id: int, access_token: str) -> List[List[float]]:
         """Fetches the lat/lng stream for a given activity."""
         headers = self.get_api_headers(access_token)
         params = {'keys': 'latlng', 'key_by_type': 'true'}
         
         try:
-            response = requests.get(
+            with self._session.get(
                 f"{self.API_URL}/activities/{activity_id}/streams", 
                 headers=headers, 
                 params=params,
-                timeout=15
-            )
-            response.raise_for_status()
-            data = response.json()
-            return data.get('latlng', {}).get('data', [])
-        except requests.RequestException as e:
+                timeout=15,
+                stream=True
+            ) as response:
+                response.raise_for_status()
+                # Parse only latlng.data straight off the socket, skipping the
+                # other streams; the raw body still needs gzip decoding
+                response.raw.decode_content = True
+                return list(ijson.items(response.raw, 'latlng.data.item', use_float=True))
+        except (requests.RequestException, urllib3.exceptions.HTTPError) as e:
             logger.error(f"Failed to fetch activity stream for {activity_id}: {e}")
             raise StravaAPIError(f"Failed to fetch activity stream: {e}")
+        except ijson.JSONError as e:
+            logger.error(f"Failed to parse activity stream for {activity_id}: {e}")
+            raise StravaAPIError(f"Failed to parse activity stream: {e}")
 
 def get_strava_client() -> StravaAPI:
     """Factory function to create a Strava client with configuration validation."""